@@ -0,0 +1,261 @@
+"""PowerShell AST node extraction.
+
+Two interchangeable backends: PowerShell's own parser in a persistent pwsh
+runspace (ASTParser), or tree-sitter in-process (TreeSitterParser).
+"""
+
+import importlib.metadata
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+from . import config
+from .runspace import PwshRunspace
+from .utils import _json_loads, compute_fingerprint
+
+try:
+    import tree_sitter
+    import tree_sitter_powershell
+    TREE_SITTER_AVAILABLE = True
+except ImportError:
+    TREE_SITTER_AVAILABLE = False
+
+# Server loop: decode one snippet per line, emit its AST node type names as JSON
+_PARSE_AST_SERVER = r"""
+while (($line = [Console]::In.ReadLine()) -ne $null) {
+    try {
+        $code = [System.Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($line))
+        $tokens = $null; $errs = $null
+        $ast = [System.Management.Automation.Language.Parser]::ParseInput($code, [ref]$tokens, [ref]$errs)
+        $nodes = @($ast.FindAll({ $true }, $true) | ForEach-Object { $_.GetType().Name })
+        [Console]::Out.WriteLine((ConvertTo-Json -InputObject @{ Nodes = $nodes } -Compress))
+    } catch {
+        [Console]::Out.WriteLine((ConvertTo-Json -InputObject @{ Error = $_.Exception.Message } -Compress))
+    }
+    [Console]::Out.WriteLine($EndMarker)
+    [Console]::Out.Flush()
+}
+"""
+
+class BaseASTParser:
+    """
+    Returns the AST node type names of PowerShell code.
+
+    Results depend only on the code string, so they are memoized in memory
+    and, if cache_dir is given, on disk across runs. Subclasses implement
+    _parse_uncached() and _cache_version().
+
+    The disk cache is SQLite in WAL mode, so parallel evaluation runs can
+    share one cache_dir. Its file name includes _cache_version(), so a changed
+    parser never serves node lists from an older one.
+    """
+
+    # Disk cache file name prefix; backends name node types differently
+    CACHE_NAME = "nodes"
+
+    def __init__(self, cache_size: int = None, cache_dir: Optional[Path] = None):
+        """
+        Args:
+            cache_size: Max snippets kept in memory (default from config).
+            cache_dir: Directory for a persistent cache; disabled if None.
+        """
+        self.cache_size = cache_size if cache_size is not None else config.AST_CACHE_SIZE
+        self._memo: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        if cache_dir is not None:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            path = Path(cache_dir) / f"{self.CACHE_NAME}-{self._cache_version()}.sqlite3"
+            # Autocommit; the busy timeout waits out other processes' writes
+            self._disk = sqlite3.connect(str(path), timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, nodes TEXT NOT NULL)")
+
+    def parse(self, code: str) -> List[str]:
+        """
+        Parse code and return its node type names in traversal order.
+
+        Raises:
+            RuntimeError: if the parser fails or the backend is unavailable.
+        """
+        key = compute_fingerprint(code)
+        nodes = self._lookup(key)
+        if nodes is None:
+            nodes = self._parse_uncached(code)
+            self._store(key, nodes)
+        return list(nodes)
+
+    def parse_batch(self, codes: List[str]) -> List[List[str]]:
+        """Parse many snippets, warming the cache first."""
+        self.prefetch(codes)
+        return [self.parse(code) for code in codes]
+
+    def prefetch(self, codes: List[str]):
+        """Warm the cache for codes; a no-op for backends without batch support."""
+
+    def _parse_uncached(self, code: str) -> Tuple[str, ...]:
+        raise NotImplementedError
+
+    def _cache_version(self) -> str:
+        """Short tag that changes whenever the parser's output could change."""
+        raise NotImplementedError
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, ...]]:
+        with self._cache_lock:
+            nodes = self._memo.get(key)
+            if nodes is not None:
+                self._memo.move_to_end(key)
+                return nodes
+            if self._disk is not None:
+                row = self._disk.execute("SELECT nodes FROM nodes WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    nodes = tuple(_json_loads(row[0]))
+                    self._remember(key, nodes)
+            return nodes
+
+    def _store(self, key: str, nodes: Tuple[str, ...]):
+        with self._cache_lock:
+            self._remember(key, nodes)
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)",
+                                   (key, json.dumps(nodes)))
+
+    def _remember(self, key: str, nodes: Tuple[str, ...]):
+        self._memo[key] = nodes
+        if len(self._memo) > self.cache_size:
+            self._memo.popitem(last=False)
+
+    def close(self):
+        """Flush and close the disk cache."""
+        with self._cache_lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+class ASTParser(BaseASTParser):
+    """
+    PowerShell's own parser (.NET Ast type names, e.g. CommandAst).
+
+    One instance keeps the parser loaded in a single pwsh process and can be
+    shared by ASTValidator and CodeBLEUCalculator.
+    """
+
+    def __init__(self, pwsh_path: str = "pwsh", cache_size: int = None,
+                 cache_dir: Optional[Path] = None):
+        """
+        Args:
+            pwsh_path: PowerShell executable.
+            cache_size: Max snippets kept in memory (default from config).
+            cache_dir: Directory for a persistent cache; disabled if None.
+        """
+        self.pwsh_path = pwsh_path
+        super().__init__(cache_size, cache_dir)
+        self.runspace = PwshRunspace(_PARSE_AST_SERVER, pwsh_path)
+
+    def _cache_version(self) -> str:
+        # Server script plus the installed pwsh binary (upgrades change size/mtime)
+        identity = self.pwsh_path
+        resolved = shutil.which(self.pwsh_path)
+        if resolved:
+            st = os.stat(resolved)
+            identity = f"{os.path.realpath(resolved)}:{st.st_size}:{st.st_mtime_ns}"
+        return compute_fingerprint(f"{_PARSE_AST_SERVER}\0{identity}")[:12]
+
+    def prefetch(self, codes: List[str]):
+        """
+        Warm the cache for all uncached codes in one pipelined round trip.
+
+        Best effort: snippets that fail here are simply left uncached, so the
+        subsequent parse() call reports the error.
+        """
+        missing = {}
+        for code in codes:
+            key = compute_fingerprint(code)
+            if key not in missing and self._lookup(key) is None:
+                missing[key] = code
+        if not missing:
+            return
+        try:
+            responses = self.runspace.request_many(list(missing.values()))
+        except RuntimeError:
+            return
+        for key, response in zip(missing, responses):
+            try:
+                self._store(key, self._decode(response))
+            except (ValueError, RuntimeError):
+                continue
+
+    def _parse_uncached(self, code: str) -> Tuple[str, ...]:
+        return self._decode(self.runspace.request(code))
+
+    @staticmethod
+    def _decode(response: bytes) -> Tuple[str, ...]:
+        data = _json_loads(response)
+        if 'Error' in data:
+            raise RuntimeError(f"Parser error: {data['Error']}")
+        return tuple(data.get('Nodes', []))
+
+    def close(self):
+        """Shut down the parser runspace and flush the disk cache."""
+        self.runspace.close()
+        super().close()
+
+class TreeSitterParser(BaseASTParser):
+    """
+    In-process tree-sitter-powershell parser (grammar names, e.g. command).
+
+    Needs no pwsh at all; node types are the grammar's named nodes in
+    pre-order, so scores are not comparable with ASTParser's.
+    """
+
+    CACHE_NAME = "nodes_tree_sitter"
+
+    def __init__(self, cache_size: int = None, cache_dir: Optional[Path] = None):
+        if not TREE_SITTER_AVAILABLE:
+            raise ImportError("TreeSitterParser requires tree-sitter and tree-sitter-powershell")
+        super().__init__(cache_size, cache_dir)
+        self._parser = tree_sitter.Parser(tree_sitter.Language(tree_sitter_powershell.language()))
+        self._parse_lock = threading.Lock()  # tree-sitter parsers are not thread safe
+
+    def _cache_version(self) -> str:
+        try:
+            grammar = importlib.metadata.version("tree-sitter-powershell")
+        except importlib.metadata.PackageNotFoundError:
+            grammar = "unknown"
+        return compute_fingerprint(f"tree-sitter-powershell {grammar}")[:12]
+
+    def _parse_uncached(self, code: str) -> Tuple[str, ...]:
+        with self._parse_lock:
+            tree = self._parser.parse(code.encode('utf-8'))
+        # Depth-first walk with a cursor; anonymous nodes are punctuation/keywords
+        types = []
+        cursor = tree.walk()
+        while True:
+            if cursor.node.is_named:
+                types.append(cursor.node.type)
+            if cursor.goto_first_child():
+                continue
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return tuple(types)
+
+def make_parser(backend: str = None, pwsh_path: str = "pwsh", cache_size: int = None,
+                cache_dir: Optional[Path] = None) -> BaseASTParser:
+    """
+    Create the AST parser for a backend name (default from config).
+
+    Raises:
+        ValueError: for an unknown backend.
+    """
+    backend = backend or config.AST_PARSER_BACKEND
+    if backend == "pwsh":
+        return ASTParser(pwsh_path, cache_size, cache_dir)
+    if backend == "tree-sitter":
+        return TreeSitterParser(cache_size, cache_dir)
+    raise ValueError(f"Unknown AST parser backend: {backend!r} (expected 'pwsh' or 'tree-sitter')")
@@ -1,36 +1,24 @@
 """Algorithm 3: AST-Based Static Analysis Validation."""
 
-import subprocess
-import tempfile
-import json
-from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional
+from .ast_parser import BaseASTParser, make_parser
+
+# Node types per backend: .NET Ast names (pwsh) and tree-sitter-powershell names
+_INVOKE_EXPRESSION_NODES = {'InvokeExpressionAst'}
+_MEMBER_ACCESS_NODES = {'MemberExpressionAst', 'InvokeMemberExpressionAst',
+                        'member_access', 'invokation_expression'}
 
 class ASTValidator:
     """
     Validates PowerShell code by parsing its abstract syntax tree.
-    Uses PowerShell's own parser via subprocess.
+    Uses PowerShell's own parser via a persistent runspace, or tree-sitter
+    when config.AST_PARSER_BACKEND selects it.
     """
 
-    def __init__(self, pwsh_path: str = "pwsh"):
+    def __init__(self, pwsh_path: str = "pwsh", parser: Optional[BaseASTParser] = None):
         self.pwsh_path = pwsh_path
-        # Script to parse AST and detect dangerous constructs
-        self.parser_script = Path(__file__).parent / "parse_ast.ps1"
-        # Create a temporary PowerShell script if not exists
-        if not self.parser_script.exists():
-            self._create_parser_script()
-
-    def _create_parser_script(self):
-        """Create a PowerShell script that outputs AST node types."""
-        script_content = """
-param([string]$code)
-
-$ast = [System.Management.Automation.Language.Parser]::ParseInput($code, [ref]$null, [ref]$null)
-$visitor = New-Object -TypeName "System.Management.Automation.Language.CustomAstVisitor2"
-$ast.Visit($visitor) | Out-Null
-$visitor.Nodes | ConvertTo-Json
-"""
-        self.parser_script.write_text(script_content)
+        # Parser runspace; pass one in to share it with CodeBLEUCalculator
+        self.parser = parser or make_parser(pwsh_path=pwsh_path)
 
     def validate(self, code: str) -> Dict[str, any]:
         """
@@ -43,44 +31,41 @@ $visitor.Nodes | ConvertTo-Json
                 'node_types': List[str]
             }
         """
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.ps1', delete=False) as f:
-            f.write(code)
-            script_path = f.name
+        if not code.strip():
+            # Nothing to parse, hence nothing to flag
+            return {'pass': True, 'vulnerabilities': [], 'node_types': []}
 
         try:
-            # Invoke PowerShell parser
-            result = subprocess.run(
-                [self.pwsh_path, "-File", str(self.parser_script), "-code", code],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode != 0:
-                return {'pass': False, 'vulnerabilities': ['Parser error'], 'node_types': []}
-
-            data = json.loads(result.stdout)
-            node_types = data.get('Nodes', [])
-            vulns = self._detect_vulnerabilities(node_types, code)
-            return {
-                'pass': len(vulns) == 0,
-                'vulnerabilities': vulns,
-                'node_types': node_types
-            }
+            # Invoke the configured parser backend
+            node_types = self.parser.parse(code)
+        except RuntimeError:
+            return {'pass': False, 'vulnerabilities': ['Parser error'], 'node_types': []}
         except Exception as e:
             return {'pass': False, 'vulnerabilities': [str(e)], 'node_types': []}
-        finally:
-            Path(script_path).unlink(missing_ok=True)
+
+        vulns = self._detect_vulnerabilities(node_types, code)
+        return {
+            'pass': len(vulns) == 0,
+            'vulnerabilities': vulns,
+            'node_types': node_types
+        }
+
+    def validate_batch(self, codes: List[str]) -> List[Dict[str, any]]:
+        """Validate many snippets, parsing them in one runspace round trip."""
+        self.parser.prefetch(codes)
+        return [self.validate(code) for code in codes]
 
     def _detect_vulnerabilities(self, node_types: List[str], code: str) -> List[str]:
         """Map node types to CWE vulnerabilities."""
         vulns = []
+        types = set(node_types)
         # InvokeExpressionAst
-        if 'InvokeExpressionAst' in node_types:
+        if types & _INVOKE_EXPRESSION_NODES:
             vulns.append('CWE-78: OS Command Injection (Invoke-Expression)')
         # DownloadString usage
-        if 'MemberExpressionAst' in node_types and 'DownloadString' in code:
+        if types & _MEMBER_ACCESS_NODES and 'DownloadString' in code:
             vulns.append('CWE-494: Download of Code Without Integrity Check')
         # EncodedCommand
-        if '-EncodedCommand' in code or 'EncodedCommand' in node_types:
+        if '-EncodedCommand' in code or 'EncodedCommand' in types:
             vulns.append('CWE-693: Protection Mechanism Failure (Encoded Command)')
         return vulns
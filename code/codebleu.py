@@ -4,19 +4,28 @@ Combines n-gram BLEU with syntactic AST node type similarity.
 Based on the methodology described in Ren et al. (2020).
 """
 
+import math
 import re
-import subprocess
-import tempfile
-from pathlib import Path
+from functools import lru_cache
 from typing import List, Set, Dict, Optional, Tuple
 from collections import Counter
+from .ast_parser import BaseASTParser, make_parser
 
-try:
-    from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-    NLTK_AVAILABLE = True
-except ImportError:
-    NLTK_AVAILABLE = False
-    print("Warning: nltk not installed. BLEU scores will be approximated.")
+# Keep PowerShell cmdlets and variables intact
+_TOKEN_RE = re.compile(r'[A-Za-z][A-Za-z0-9_-]*|\S')
+
+# Numerator used for n-gram orders with no matches (Chen & Cherry method 1)
+_SMOOTHING_EPSILON = 0.1
+
+@lru_cache(maxsize=4096)
+def _tokenize(code: str) -> Tuple[str, ...]:
+    """Split code into identifier and single-character tokens (memoized)."""
+    return tuple(_TOKEN_RE.findall(code))
+
+@lru_cache(maxsize=4096)
+def _ngram_counts(tokens: Tuple[str, ...], n: int) -> Counter:
+    """Counter of the n-grams in tokens (memoized; do not mutate)."""
+    return Counter(zip(*(tokens[i:] for i in range(n))))
 
 
 class CodeBLEUCalculator:
@@ -25,11 +34,12 @@ class CodeBLEUCalculator:
     def __init__(self,
                  weights: Tuple[float, float] = (0.5, 0.5),  # BLEU weight, AST weight
                  ngram_order: int = 4,
-                 pwsh_path: str = "pwsh"):
+                 pwsh_path: str = "pwsh",
+                 parser: Optional[BaseASTParser] = None):
         self.weights = weights
         self.ngram_order = ngram_order
         self.pwsh_path = pwsh_path
-        self.smoother = SmoothingFunction().method1 if NLTK_AVAILABLE else None
+        self.parser = parser or make_parser(pwsh_path=pwsh_path)
 
     def compute(self, reference: str, candidate: str) -> float:
         """
@@ -42,54 +52,71 @@ class CodeBLEUCalculator:
         Returns:
             Score between 0 and 1.
         """
+        # Cheap exits that avoid the parser entirely. Snippets equal up to
+        # surrounding whitespace parse to the same node types (AST similarity
+        # 1.0); BLEU is still computed, as it is below 1 for snippets shorter
+        # than ngram_order. Inner whitespace can change the parse (a newline
+        # splits statements), so those pairs take the full path
+        ref_tokens = _tokenize(reference)
+        if ref_tokens and reference.strip() == candidate.strip():
+            codebleu = self.weights[0] * self._bleu(ref_tokens, ref_tokens) + self.weights[1]
+            return min(max(codebleu, 0.0), 1.0)
+        if not candidate.strip():
+            return 0.0
+
+        # Tokenize and parse each snippet once; both sub-metrics share the result
+        ref_tokens, ref_nodes = self._analyze(reference)
+        cand_tokens, cand_nodes = self._analyze(candidate)
+
         # 1. n-gram BLEU
-        bleu_score = self._bleu(reference, candidate)
+        bleu_score = self._bleu(ref_tokens, cand_tokens)
 
         # 2. Syntactic AST node type similarity
-        ast_sim = self._ast_similarity(reference, candidate)
+        ast_sim = self._ast_similarity(ref_nodes, cand_nodes)
 
         # Weighted combination
         codebleu = self.weights[0] * bleu_score + self.weights[1] * ast_sim
         return min(max(codebleu, 0.0), 1.0)
 
-    def _bleu(self, reference: str, candidate: str) -> float:
-        """Compute smoothed BLEU score."""
-        if not NLTK_AVAILABLE:
-            # Fallback: simple token overlap
-            ref_tokens = self._tokenize(reference)
-            cand_tokens = self._tokenize(candidate)
-            if not ref_tokens:
-                return 1.0
-            overlap = len(set(ref_tokens) & set(cand_tokens))
-            return overlap / len(set(ref_tokens))
-
-        ref_tokens = self._tokenize(reference)
-        cand_tokens = self._tokenize(candidate)
-
-        # BLEU expects list of references (each a list of tokens)
-        return sentence_bleu([ref_tokens], cand_tokens,
-                             weights=self._ngram_weights(),
-                             smoothing_function=self.smoother)
-
-    def _ngram_weights(self) -> Tuple[float, ...]:
-        """Create uniform weights up to ngram_order."""
-        weight = 1.0 / self.ngram_order
-        return tuple([weight] * self.ngram_order)
+    def _analyze(self, code: str) -> Tuple[Tuple[str, ...], List[str]]:
+        """Return (tokens, AST node types) for code; both are memoized."""
+        return _tokenize(code), self._get_ast_node_types(code)
+
+    def _bleu(self, ref_tokens: Tuple[str, ...], cand_tokens: Tuple[str, ...]) -> float:
+        """
+        Compute smoothed sentence BLEU from token tuples.
 
-    def _tokenize(self, code: str) -> List[str]:
+        Matches nltk's sentence_bleu with uniform weights and
+        SmoothingFunction().method1: clipped n-gram precision, epsilon
+        numerator for empty orders, and the brevity penalty.
+        """
+        if not cand_tokens:
+            return 0.0
+        weight = 1.0 / self.ngram_order
+        log_precisions = []
+        for n in range(1, self.ngram_order + 1):
+            cand_counts = _ngram_counts(cand_tokens, n)
+            # Clipped counts: each n-gram credited at most as often as in the reference
+            hits = sum((cand_counts & _ngram_counts(ref_tokens, n)).values())
+            total = max(1, sum(cand_counts.values()))
+            if hits == 0:
+                if n == 1:
+                    return 0.0  # no unigram overlap at all
+                hits = _SMOOTHING_EPSILON
+            log_precisions.append(weight * math.log(hits / total))
+
+        ref_len, cand_len = len(ref_tokens), len(cand_tokens)
+        brevity = 1.0 if cand_len > ref_len else math.exp(1 - ref_len / cand_len)
+        return brevity * math.exp(math.fsum(log_precisions))
+
+    def _tokenize(self, code: str) -> Tuple[str, ...]:
         """Simple tokenization: split on non-alphanumeric."""
-        # Keep PowerShell cmdlets and variables intact
-        tokens = re.findall(r'[A-Za-z][A-Za-z0-9_-]*|\S', code)
-        return tokens
+        return _tokenize(code)
 
-    def _ast_similarity(self, ref: str, cand: str) -> float:
+    def _ast_similarity(self, ref_nodes: List[str], cand_nodes: List[str]) -> float:
         """
         Compute Jaccard similarity between AST node type multisets.
-        Uses PowerShell's own parser via subprocess.
         """
-        ref_nodes = self._get_ast_node_types(ref)
-        cand_nodes = self._get_ast_node_types(cand)
-
         if not ref_nodes:
             return 1.0 if not cand_nodes else 0.0
 
@@ -97,46 +124,18 @@ class CodeBLEUCalculator:
         ref_counter = Counter(ref_nodes)
         cand_counter = Counter(cand_nodes)
 
-        # Intersection size = sum of min counts
-        intersection = sum(min(ref_counter[k], cand_counter[k]) for k in ref_counter)
-        union = sum(max(ref_counter[k], cand_counter[k]) for k in set(ref_counter) | set(cand_counter))
+        # Intersection/union sizes = sums of per-type min/max counts
+        intersection = sum((ref_counter & cand_counter).values())
+        union = sum((ref_counter | cand_counter).values())
 
         return intersection / union if union > 0 else 0.0
 
     def _get_ast_node_types(self, code: str) -> List[str]:
         """
-        Call PowerShell parser to get list of AST node type names.
+        Ask the PowerShell parser for the list of AST node type names.
         Returns empty list on error.
         """
-        # Use a temporary script similar to ast_validator.py
-        parser_script = Path(__file__).parent / "parse_ast.ps1"
-        if not parser_script.exists():
-            self._create_parser_script(parser_script)
-
         try:
-            result = subprocess.run(
-                [self.pwsh_path, "-File", str(parser_script), "-code", code],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode != 0:
-                return []
-            # Expect JSON list of node types
-            import json
-            data = json.loads(result.stdout)
-            return data.get('Nodes', [])
+            return self.parser.parse(code)
         except Exception:
             return []
-
-    def _create_parser_script(self, path: Path):
-        """Create a PowerShell script that outputs AST node types."""
-        script_content = """
-param([string]$code)
-
-$ast = [System.Management.Automation.Language.Parser]::ParseInput($code, [ref]$null, [ref]$null)
-$visitor = New-Object -TypeName "System.Management.Automation.Language.CustomAstVisitor2"
-$ast.Visit($visitor) | Out-Null
-$visitor.Nodes | ConvertTo-Json
-"""
-        path.write_text(script_content)
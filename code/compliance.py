@@ -1,19 +1,30 @@
 """Algorithm 6: Multi-Layer Security Compliance Verification."""
 
-from typing import Dict, List, Any, Tuple
+from pathlib import Path
+from typing import Dict, List, Any, Tuple, Optional
+from .ast_parser import make_parser
 from .ast_validator import ASTValidator
-from .security_patterns import SecurityPatterns
+from .security_patterns import SecurityPatterns, PatternMatcher
 from .secure_executor import SecureExecutor
 from .metrics import Metrics  # now imports full CodeBLEU
 
 class ComplianceVerifier:
     """Orchestrates multi-layer verification of generated code."""
 
-    def __init__(self):
-        self.ast_validator = ASTValidator()
+    def __init__(self, ast_cache_dir: Optional[Path] = None):
+        """
+        Args:
+            ast_cache_dir: Optional directory for a persistent AST cache.
+        """
+        # One parser (and its cache) shared by the AST layer and CodeBLEU
+        self.parser = make_parser(cache_dir=ast_cache_dir)
+        self.ast_validator = ASTValidator(parser=self.parser)
         self.patterns = SecurityPatterns()
+        self._vuln_matcher = PatternMatcher(self.patterns.critical_patterns +
+                                            self.patterns.high_patterns,
+                                            ignore_case=False)
         self.executor = SecureExecutor()
-        self.metrics = Metrics()  # includes CodeBLEU
+        self.metrics = Metrics(parser=self.parser)  # includes CodeBLEU
 
     def verify(self, generated: str, source: str, test_cases: List[Dict] = None) -> Tuple[bool, List[str]]:
         """
@@ -29,15 +40,20 @@ class ComplianceVerifier:
         """
         issues = []
 
+        # Layer 2 runs first: pattern matching is pure Python and cheap
+        gen_hits = self._vuln_matcher.matches(generated)
+        introduced = len(gen_hits) > self._count_vulnerabilities(source)
+        if introduced and self._has_critical(gen_hits):
+            # Non-compliant whatever the other layers say; skip pwsh and sandbox work
+            return False, ["NEW_VULNERABILITY_INTRODUCED"]
+
         # Layer 1: Static Analysis
         ast_result = self.ast_validator.validate(generated)
         if not ast_result['pass']:
             issues.extend(ast_result['vulnerabilities'])
 
         # Layer 2: Pattern Matching
-        source_vulns = self._count_vulnerabilities(source)
-        gen_vulns = self._count_vulnerabilities(generated)
-        if gen_vulns > source_vulns:
+        if introduced:
             issues.append("NEW_VULNERABILITY_INTRODUCED")
 
         # Layer 3: Sandboxed Execution (if test cases provided)
@@ -57,13 +73,35 @@ class ComplianceVerifier:
         compliant = len(issues) == 0
         return compliant, issues
 
+    def verify_batch(self, pairs: List[Tuple[str, str]],
+                     test_cases: List[Dict] = None) -> List[Tuple[bool, List[str]]]:
+        """
+        Verify many (generated, source) pairs.
+
+        All snippets are parsed up front in one runspace round trip, so the
+        per-pair AST and CodeBLEU layers hit the parser cache.
+        """
+        self.parser.prefetch([code for generated, source in pairs
+                              if not self._fails_fast(generated, source)
+                              for code in (generated, source)])
+        return [self.verify(generated, source, test_cases) for generated, source in pairs]
+
+    def close(self):
+        """Release the shared parser, its cache and the executor's runspace."""
+        self.parser.close()
+        self.executor.close()
+
+    def _has_critical(self, hits) -> bool:
+        """True if any matched pattern index is a critical pattern."""
+        n_critical = len(self.patterns.critical_patterns)
+        return any(i < n_critical for i in hits)
+
+    def _fails_fast(self, generated: str, source: str) -> bool:
+        """True if verify() rejects the pair on pattern matching alone."""
+        gen_hits = self._vuln_matcher.matches(generated)
+        return (len(gen_hits) > self._count_vulnerabilities(source)
+                and self._has_critical(gen_hits))
+
     def _count_vulnerabilities(self, code: str) -> int:
         """Count number of vulnerability patterns in code."""
-        count = 0
-        for pat in self.patterns.critical_patterns:
-            if pat in code:
-                count += 1
-        for pat in self.patterns.high_patterns:
-            if pat in code:
-                count += 1
-        return count
+        return len(self._vuln_matcher.matches(code))
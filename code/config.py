@@ -12,11 +12,17 @@ RESULTS_DIR = BASE_DIR / "results"
 DEFAULT_LLM_MODEL = "gpt-4o"  # or "codellama-7b", "deepseek-coder-v2-lite"
 LLM_TEMPERATURE = 0.2
 LLM_MAX_TOKENS = 1024
+LLM_CONCURRENCY = 16   # in-flight requests for remote batch generation
+LLM_QUANTIZATION = None   # "4bit" or "8bit" for local models (needs bitsandbytes)
 
 # RAG settings
 RAG_TOP_K = 5
 RAG_ALPHA = 0.6   # weight for semantic similarity
 RAG_BETA = 0.4    # weight for security (1/(1+risk))
+RAG_ENCODE_BATCH_SIZE = 64
+RAG_HNSW_M = 32                 # graph neighbours per node
+RAG_HNSW_EF_CONSTRUCTION = 200
+RAG_HNSW_EF_SEARCH = 64         # raised to the candidate count if smaller
 
 # Security pattern definitions
 CRITICAL_PATTERNS = ["Invoke-Expression", "IEX", "Invoke-Mimikatz"]
@@ -30,6 +36,19 @@ HIGH_WEIGHT = 2
 MEDIUM_WEIGHT = 1
 LOW_WEIGHT = 0
 
+# Evaluation settings
+EVAL_BATCH_SIZE = 32   # items generated, then verified together
+EVAL_WORKERS = 4       # micro-batches in flight at once
+
 # Execution settings
 POWERSHELL_EXECUTABLE = "pwsh"  # or "powershell.exe" on Windows
+PWSH_BASE_ARGS = ("-NoProfile", "-NonInteractive")  # passed on every pwsh launch
 SANDBOX_DIR = RESULTS_DIR / "sandbox"
+EXECUTOR_TIMEOUT = 30   # seconds per command in the persistent runspace
+SCRIPT_TIMEOUT = 60     # seconds per sandboxed execute_script run
+CRITICAL_LOG_PATH = RESULTS_DIR / "critical.log"  # manual-review alerts
+
+# AST parsing and cache
+AST_PARSER_BACKEND = "pwsh"         # or "tree-sitter" (in-process, no pwsh needed)
+AST_CACHE_SIZE = 8192               # snippets memoized in memory
+AST_CACHE_DIR = RESULTS_DIR / "ast_cache"
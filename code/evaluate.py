@@ -1,34 +1,52 @@
 """Main evaluation script."""
 
+import csv
+import itertools
 import json
 import argparse
-import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from .llm_client import LLMClient
-from .risk_profiler import RiskProfiler
+from .risk_profiler import RiskProfiler, ALERT_LOGGER
 from .rag_retriever import RAGRetriever
 from .prompt_defense import PromptDefense
 from .compliance import ComplianceVerifier
 from .metrics import Metrics
+from .utils import start_log_listener
 from . import config
 
+# Column order of the results CSV
+RESULT_FIELDS = ['nl', 'original', 'generated', 'risk_original', 'compliant',
+                 'issues', 'model', 'rag']
+
 def load_dataset(path: Path):
     with open(path, 'r') as f:
         data = [json.loads(line) for line in f]
     return data
 
 def main(args):
+    # pwsh processes, the AST cache and the alert log are released even if a batch fails
+    log_listener = start_log_listener(config.CRITICAL_LOG_PATH, ALERT_LOGGER)
+    try:
+        verifier = ComplianceVerifier(ast_cache_dir=config.AST_CACHE_DIR)
+        try:
+            run_evaluation(args, verifier)
+        finally:
+            verifier.close()
+    finally:
+        log_listener.stop()
+
+def run_evaluation(args, verifier: ComplianceVerifier):
     # Setup
     dataset = load_dataset(args.input)
     if args.sample:
         dataset = dataset[:args.sample]
 
-    results = []
     profiler = RiskProfiler()
-    verifier = ComplianceVerifier()
     metrics = Metrics()
 
     if args.rag:
@@ -42,7 +60,11 @@ def main(args):
     )
     defense = PromptDefense(system_prompt)
 
-    for item in tqdm(dataset):
+    # One client for the whole run (local models load once)
+    client = LLMClient(model_name=args.model, quantization=args.quantize)
+
+    def prepare(item: Dict) -> Tuple[int, str]:
+        """Risk-profile an item and build its defended prompt."""
         nl = item['nl']
         original_code = item['code']
 
@@ -56,19 +78,10 @@ def main(args):
         if injected:
             # Skip or handle
             pass
+        return risk_orig, safe_prompt
 
-        # Retrieve RAG patterns if enabled
-        retrieved = []
-        if args.rag:
-            retrieved = retriever.retrieve(nl)
-
-        # Generate
-        client = LLMClient(model_name=args.model)
-        if args.rag:
-            generated = client.generate_with_rag(safe_prompt, retrieved)
-        else:
-            generated = client.generate(safe_prompt)
-
+    def postprocess(generated: str) -> str:
+        """Filter an LLM response and extract its code."""
         # Post-filter
         generated = defense.filter_output(generated)
 
@@ -77,35 +90,79 @@ def main(args):
             generated = generated.split("```powershell")[1].split("```")[0].strip()
         elif "```" in generated:
             generated = generated.split("```")[1].split("```")[0].strip()
+        return generated
 
-        # Verify compliance
-        compliant, issues = verifier.verify(generated, original_code)
+    def process_batch(batch: List[Dict]) -> List[Dict]:
+        """Generate and verify one micro-batch; returns its result rows in order."""
+        prepared = [prepare(item) for item in batch]
+        prompts = [safe_prompt for _, safe_prompt in prepared]
 
-        results.append({
-            'nl': nl,
-            'original': original_code,
+        # Phase 1: generate refactorings for the micro-batch in one call
+        if args.rag:
+            # Retrieve RAG patterns for the whole micro-batch
+            retrieved = retriever.retrieve_batch([item['nl'] for item in batch])
+            responses = client.generate_batch_with_rag(prompts, retrieved)
+        else:
+            responses = client.generate_batch(prompts)
+        outputs = [(risk_orig, postprocess(response))
+                   for (risk_orig, _), response in zip(prepared, responses)]
+
+        # Phase 2: verify them together (one AST round trip)
+        verdicts = verifier.verify_batch(
+            [(generated, item['code']) for item, (_, generated) in zip(batch, outputs)]
+        )
+
+        return [{
+            'nl': item['nl'],
+            'original': item['code'],
             'generated': generated,
             'risk_original': risk_orig,
             'compliant': compliant,
             'issues': '; '.join(issues),
             'model': args.model,
             'rag': args.rag
-        })
+        } for item, (risk_orig, generated), (compliant, issues) in zip(batch, outputs, verdicts)]
+
+    batches = (dataset[start:start + config.EVAL_BATCH_SIZE]
+               for start in range(0, len(dataset), config.EVAL_BATCH_SIZE))
+
+    # Rows are streamed to disk as batches finish; only running counts stay in memory
+    out_path = args.output / f"results_{args.model}_rag{args.rag}.csv"
+    total = introduced = compliant = passed = 0
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        # Micro-batches run concurrently so LLM calls overlap with AST parsing and
+        # sandboxing of other batches. At most args.workers batches are in flight:
+        # the next one is submitted only once the oldest has finished, so a slow
+        # batch cannot make finished later batches pile up in memory
+        with ThreadPoolExecutor(max_workers=args.workers) as ex, tqdm(total=len(dataset)) as pbar:
+            pending = deque(ex.submit(process_batch, batch)
+                            for batch in itertools.islice(batches, args.workers))
+            while pending:
+                rows = pending.popleft().result()  # dataset order
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    pending.append(ex.submit(process_batch, next_batch))
+                writer.writerows(rows)
+                f.flush()  # completed rows survive a crash
+
+                originals = [row['original'] for row in rows]
+                generated = [row['generated'] for row in rows]
+                total += len(rows)
+                introduced += int(metrics.introduced_mask(originals, generated).sum())
+                compliant += int(metrics.compliant_mask(generated).sum())
+                passed += len(rows)  # placeholder: functional tests not run
+                pbar.update(len(rows))
 
     # Compute aggregate metrics
-    df = pd.DataFrame(results)
-    vir = metrics.vulnerability_introduction_rate(df['original'].tolist(), df['generated'].tolist())
-    scr = metrics.security_compliance_rate(df['generated'].tolist())
-    fcr = metrics.functional_correctness_rate(df['generated'].tolist(), [True]*len(df))  # placeholder
+    vir, scr, fcr = (100.0 * count / total if total else 0
+                     for count in (introduced, compliant, passed))
 
     print(f"Results for {args.model} (RAG={args.rag}):")
     print(f"  VIR = {vir:.2f}%")
     print(f"  SCR = {scr:.2f}%")
     print(f"  FCR = {fcr:.2f}%")
-
-    # Save
-    out_path = args.output / f"results_{args.model}_rag{args.rag}.csv"
-    df.to_csv(out_path, index=False)
     print(f"Saved to {out_path}")
 
 if __name__ == "__main__":
@@ -114,7 +171,10 @@ if __name__ == "__main__":
     parser.add_argument('--output', type=Path, default=config.RESULTS_DIR, help='Output directory')
     parser.add_argument('--model', default='gpt-4o', help='Model name')
     parser.add_argument('--rag', action='store_true', help='Enable RAG')
+    parser.add_argument('--quantize', choices=['4bit', '8bit'], help='Quantize local model weights')
     parser.add_argument('--sample', type=int, help='Use only N samples')
+    parser.add_argument('--workers', type=int, default=config.EVAL_WORKERS,
+                        help='Micro-batches processed concurrently')
     parser.add_argument('--statistics', action='store_true', help='Run McNemar test')
     args = parser.parse_args()
     args.output.mkdir(parents=True, exist_ok=True)
@@ -1,30 +1,65 @@
 """Interface to various LLMs (GPT, CodeLlama, DeepSeek, Qwen)."""
 
+import asyncio
+import importlib.util
 import os
+import threading
 from typing import List, Dict, Any, Optional
 import openai
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import torch
+from . import config
 
 class LLMClient:
     """Unified client for multiple LLMs."""
 
-    def __init__(self, model_name: str = "gpt-4o", api_key: Optional[str] = None):
+    def __init__(self, model_name: str = "gpt-4o", api_key: Optional[str] = None,
+                 quantization: Optional[str] = None):
+        """
+        Args:
+            model_name: OpenAI model name or HuggingFace model id.
+            api_key: OpenAI API key (default from OPENAI_API_KEY).
+            quantization: "4bit" or "8bit" to load local weights with
+                bitsandbytes (default from config; None keeps FP16).
+        """
         self.model_name = model_name
+        self.quantization = quantization or config.LLM_QUANTIZATION
         self.is_local = model_name not in ["gpt-4o", "gpt-3.5-turbo"]
         if not self.is_local:
-            openai.api_key = api_key or os.getenv("OPENAI_API_KEY")
+            self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+            self.client = openai.OpenAI(api_key=self.api_key)
         else:
             self._load_local_model()
+            # One model (and fast tokenizer) per process: concurrent callers take turns
+            self._generate_lock = threading.Lock()
 
     def _load_local_model(self):
         """Load a local HuggingFace model."""
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
+        # Decoder-only batching: pad on the left so generation continues each prompt
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        kwargs = {"torch_dtype": torch.float16, "device_map": "auto"}
+        if self.quantization:
+            kwargs["quantization_config"] = self._quantization_config(self.quantization)
+        if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+            kwargs["attn_implementation"] = "flash_attention_2"
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, **kwargs)
+
+    @staticmethod
+    def _quantization_config(mode: str) -> BitsAndBytesConfig:
+        """bitsandbytes settings for a quantization mode."""
+        if mode == "4bit":
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=True
+            )
+        if mode == "8bit":
+            return BitsAndBytesConfig(load_in_8bit=True)
+        raise ValueError(f"Unknown quantization mode: {mode!r} (expected '4bit' or '8bit')")
 
     def generate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.2) -> str:
         """Generate text from prompt."""
@@ -33,8 +68,43 @@ class LLMClient:
         else:
             return self._generate_local(prompt, max_tokens, temperature)
 
+    def generate_batch(self, prompts: List[str], max_tokens: int = 1024,
+                       temperature: float = 0.2) -> List[str]:
+        """
+        Generate text for many prompts; results keep input order.
+
+        Remote models are queried concurrently, local models decode the
+        whole batch in one generate() call.
+        """
+        if not prompts:
+            return []
+        if not self.is_local:
+            return asyncio.run(self.agenerate_many(prompts, max_tokens, temperature))
+        return self._generate_local_batch(prompts, max_tokens, temperature)
+
+    async def agenerate_many(self, prompts: List[str], max_tokens: int = 1024,
+                             temperature: float = 0.2, concurrency: int = None) -> List[str]:
+        """Query the OpenAI API for all prompts with bounded concurrency."""
+        semaphore = asyncio.Semaphore(concurrency or config.LLM_CONCURRENCY)
+        client = openai.AsyncOpenAI(api_key=self.api_key)
+
+        async def one(prompt: str) -> str:
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+                return response.choices[0].message.content
+
+        try:
+            return list(await asyncio.gather(*(one(p) for p in prompts)))
+        finally:
+            await client.close()
+
     def _generate_openai(self, prompt: str, max_tokens: int, temperature: float) -> str:
-        response = openai.ChatCompletion.create(
+        response = self.client.chat.completions.create(
             model=self.model_name,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=max_tokens,
@@ -43,23 +113,49 @@ class LLMClient:
         return response.choices[0].message.content
 
     def _generate_local(self, prompt: str, max_tokens: int, temperature: float) -> str:
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-        outputs = self.model.generate(
-            **inputs,
-            max_new_tokens=max_tokens,
-            temperature=temperature,
-            do_sample=True,
-            pad_token_id=self.tokenizer.eos_token_id
-        )
+        with self._generate_lock:
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                do_sample=True,
+                use_cache=True,
+                pad_token_id=self.tokenizer.eos_token_id
+            )
         return self.tokenizer.decode(outputs[0], skip_special_tokens=True)[len(prompt):].strip()
 
+    def _generate_local_batch(self, prompts: List[str], max_tokens: int, temperature: float) -> List[str]:
+        with self._generate_lock:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                do_sample=True,
+                use_cache=True,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        # Keep only the newly generated tokens of each row
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
     def generate_with_rag(self, prompt: str, retrieved_patterns: List[Dict[str, Any]]) -> str:
         """Inject retrieved patterns into prompt."""
+        return self.generate(self._rag_prompt(prompt, retrieved_patterns))
+
+    def generate_batch_with_rag(self, prompts: List[str],
+                                retrieved: List[List[Dict[str, Any]]]) -> List[str]:
+        """Batch version of generate_with_rag; retrieved[i] belongs to prompts[i]."""
+        return self.generate_batch([self._rag_prompt(prompt, patterns)
+                                    for prompt, patterns in zip(prompts, retrieved)])
+
+    @staticmethod
+    def _rag_prompt(prompt: str, retrieved_patterns: List[Dict[str, Any]]) -> str:
         context = "\n\n".join([f"Secure pattern: {p['code']}" for p in retrieved_patterns])
-        full_prompt = (
+        return (
             f"Context - secure examples:\n{context}\n\n"
             f"Task: {prompt}\n\n"
             "Generate a secure PowerShell command based on the context. "
             "Avoid dangerous patterns like Invoke-Expression, DownloadString without hash verification, etc."
         )
-        return self.generate(full_prompt)
@@ -1,16 +1,19 @@
 """Evaluation metrics: VIR, SCR, CodeBLEU (now with full implementation)."""
 
-import re
+import numpy as np
 from typing import List, Set, Optional
 from .security_patterns import SecurityPatterns
 from .codebleu import CodeBLEUCalculator
+from .ast_parser import BaseASTParser
 
 class Metrics:
     """Computes security and functional metrics."""
 
-    def __init__(self):
+    def __init__(self, parser: Optional[BaseASTParser] = None):
         self.patterns = SecurityPatterns()
-        self.codebleu = CodeBLEUCalculator()  # Use the new full implementation
+        self.codebleu = CodeBLEUCalculator(parser=parser)  # Use the new full implementation
+        # Matrix columns: critical + high patterns, as SecurityPatterns.vulnerability_ids
+        self._n_vuln = len(self.patterns.critical_patterns) + len(self.patterns.high_patterns)
 
     def vulnerability_introduction_rate(self, source_codes: List[str], gen_codes: List[str]) -> float:
         """
@@ -23,38 +26,54 @@ class Metrics:
         Returns:
             Percentage of cases where |V_gen| > |V_src|.
         """
-        count = 0
-        for src, gen in zip(source_codes, gen_codes):
-            src_vulns = self._count_vulnerabilities(src)
-            gen_vulns = self._count_vulnerabilities(gen)
-            if gen_vulns > src_vulns:
-                count += 1
-        return (count / len(source_codes)) * 100 if source_codes else 0
+        if not source_codes:
+            return 0
+        count = np.count_nonzero(self.introduced_mask(source_codes, gen_codes))
+        return float(count / len(source_codes)) * 100
 
     def security_compliance_rate(self, gen_codes: List[str]) -> float:
         """
         Compute SCR (Equation 5). A command is compliant if no high/critical vulnerabilities.
         """
-        compliant = 0
-        for code in gen_codes:
-            if not self.patterns.contains_critical(code) and not self.patterns.contains_high(code):
-                compliant += 1
-        return (compliant / len(gen_codes)) * 100 if gen_codes else 0
+        if not gen_codes:
+            return 0
+        return float(self.compliant_mask(gen_codes).mean()) * 100
+
+    def introduced_mask(self, source_codes: List[str], gen_codes: List[str]) -> np.ndarray:
+        """Boolean per pair: True where |V_gen| > |V_src| (the VIR numerator)."""
+        n = min(len(source_codes), len(gen_codes))
+        src_counts = self._scan_matrix(source_codes[:n]).sum(axis=1)
+        gen_counts = self._scan_matrix(gen_codes[:n]).sum(axis=1)
+        return gen_counts > src_counts
+
+    def compliant_mask(self, gen_codes: List[str]) -> np.ndarray:
+        """Boolean per command: True if it has no high/critical vulnerabilities."""
+        # Every matrix column is a critical or high pattern
+        return ~self._scan_matrix(gen_codes).any(axis=1)
 
     def functional_correctness_rate(self, gen_codes: List[str], test_results: List[bool]) -> float:
         """Percentage passing functional tests."""
-        return (sum(test_results) / len(gen_codes)) * 100 if gen_codes else 0
+        if not gen_codes:
+            return 0
+        passed = np.count_nonzero(np.asarray(test_results, dtype=bool))
+        return float(passed / len(gen_codes)) * 100
 
     def semantic_similarity(self, reference: str, candidate: str) -> float:
         """Return CodeBLEU score between reference and candidate."""
         return self.codebleu.compute(reference, candidate)
 
+    def _scan_matrix(self, codes: List[str]) -> np.ndarray:
+        """
+        Scan codes once each.
+
+        Returns:
+            uint8 array of shape (len(codes), n_patterns); M[i, p] = 1 if
+            critical/high pattern p occurs in codes[i].
+        """
+        matrix = np.zeros((len(codes), self._n_vuln), dtype=np.uint8)
+        for i, code in enumerate(codes):
+            matrix[i, self.patterns.vulnerability_ids(code)] = 1
+        return matrix
+
     def _count_vulnerabilities(self, code: str) -> int:
-        count = 0
-        for pat in self.patterns.critical_patterns:
-            if re.search(pat, code, re.IGNORECASE):
-                count += 1
-        for pat in self.patterns.high_patterns:
-            if re.search(pat, code, re.IGNORECASE):
-                count += 1
-        return count
+        return self.patterns.count_vulnerabilities(code)
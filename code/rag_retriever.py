@@ -2,6 +2,7 @@
 
 import json
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss
 from typing import List, Dict, Any
@@ -17,20 +18,50 @@ class RAGRetriever:
             knowledge_base_path: Path to JSON file containing secure patterns.
         """
         with open(knowledge_base_path, 'r') as f:
-            self.kb = json.load(f)  # List of dicts with 'nl', 'code', 'risk'
-        self.model = SentenceTransformer('microsoft/codebert-base')
+            kb = json.load(f)  # List of dicts with 'nl', 'code', 'risk'
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = SentenceTransformer('microsoft/codebert-base', device=device)
+        if device == 'cuda':
+            self.model.half()  # FP16 halves memory traffic on GPU
         self.patterns = SecurityPatterns()
+        self._load_kb(kb)
         self._build_index()
 
+    def _load_kb(self, kb: List[Dict[str, Any]]):
+        """Store the knowledge base column-wise (struct of arrays)."""
+        self.kb_codes: List[str] = [item['code'] for item in kb]
+        self.kb_nl: List[str] = [item.get('nl', '') for item in kb]
+        self.kb_meta: List[Dict[str, Any]] = [
+            {key: value for key, value in item.items() if key not in ('nl', 'code')}
+            for item in kb
+        ]
+        # Per-entry risk is query independent: score missing values once here
+        self.kb_risks = np.array([item.get('risk', self.patterns.calculate_risk(item['code']))
+                                  for item in kb], dtype=np.float32)
+        # Identical code strings share an id so the diversity filter compares ints
+        code_ids: Dict[str, int] = {}
+        self.kb_code_ids = np.array([code_ids.setdefault(code, len(code_ids))
+                                     for code in self.kb_codes], dtype=np.int64)
+
     def _build_index(self):
-        """Build FAISS index over knowledge base embeddings."""
-        texts = [item['code'] for item in self.kb]
-        self.embeddings = self.model.encode(texts, convert_to_numpy=True)
+        """Build HNSW graph index over knowledge base embeddings."""
+        self.embeddings = self._encode(self.kb_codes)
         dim = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dim)  # Inner product = cosine if normalized
-        faiss.normalize_L2(self.embeddings)
+        # Inner product = cosine since embeddings are normalized
+        self.index = faiss.IndexHNSWFlat(dim, config.RAG_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = config.RAG_HNSW_EF_CONSTRUCTION
         self.index.add(self.embeddings)
 
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts in batches into L2-normalized float32 embeddings."""
+        with torch.inference_mode():
+            embeddings = self.model.encode(texts,
+                                           batch_size=config.RAG_ENCODE_BATCH_SIZE,
+                                           convert_to_numpy=True,
+                                           show_progress_bar=False,
+                                           normalize_embeddings=True)
+        return embeddings.astype(np.float32, copy=False)  # FAISS needs float32
+
     def retrieve(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
         """
         Retrieve top_k secure patterns.
@@ -42,28 +73,41 @@ class RAGRetriever:
         Returns:
             List of retrieved items with scores.
         """
+        return self.retrieve_batch([query], top_k)[0]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = None) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve top_k secure patterns for each query.
+
+        All queries are encoded together and searched with a single index call.
+        """
         if top_k is None:
             top_k = config.RAG_TOP_K
-        query_emb = self.model.encode([query], convert_to_numpy=True)
-        faiss.normalize_L2(query_emb)
+        if not queries:
+            return []
+        query_embs = self._encode(queries)
         # Retrieve more candidates then re-rank with security weight
-        scores, indices = self.index.search(query_emb, top_k * 5)
-        candidates = []
-        for idx, sim in zip(indices[0], scores[0]):
-            item = self.kb[idx]
-            risk = item.get('risk', self.patterns.calculate_risk(item['code']))
-            # Relevance score (Equation 3)
-            score = config.RAG_ALPHA * sim + config.RAG_BETA * (1.0 / (1.0 + risk))
-            candidates.append((score, item))
-        candidates.sort(reverse=True, key=lambda x: x[0])
-        # Apply diversity filter (simplified: return top_k after dedup)
-        seen = set()
-        results = []
-        for score, item in candidates:
-            code = item['code']
-            if code not in seen:
-                seen.add(code)
-                results.append({**item, 'retrieval_score': score})
-            if len(results) >= top_k:
-                break
-        return results
+        k = top_k * 5
+        params = faiss.SearchParametersHNSW(efSearch=max(config.RAG_HNSW_EF_SEARCH, k))
+        scores, indices = self.index.search(query_embs, k, params=params)
+        return [self._rerank(row_scores, row_indices, top_k)
+                for row_scores, row_indices in zip(scores, indices)]
+
+    def _rerank(self, scores: np.ndarray, indices: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """Re-rank one query's candidates by security-weighted relevance."""
+        valid = indices >= 0  # FAISS pads with -1 when the KB has fewer than k entries
+        indices, sims = indices[valid], scores[valid]
+        # Relevance score (Equation 3), vectorized over all candidates
+        final = config.RAG_ALPHA * sims + config.RAG_BETA / (1.0 + self.kb_risks[indices])
+        order = np.argsort(-final, kind='stable')
+        ranked = indices[order]
+        # Apply diversity filter (simplified: return top_k after dedup):
+        # keep the best-ranked entry of each distinct code string
+        _, first = np.unique(self.kb_code_ids[ranked], return_index=True)
+        keep = np.sort(first)[:top_k]
+        return [self._entry(ranked[pos], final[order[pos]]) for pos in keep]
+
+    def _entry(self, idx: int, score: float) -> Dict[str, Any]:
+        """Rebuild the output dict of one knowledge-base entry."""
+        return {'nl': self.kb_nl[idx], 'code': self.kb_codes[idx], **self.kb_meta[idx],
+                'retrieval_score': float(score)}
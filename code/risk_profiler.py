@@ -1,14 +1,34 @@
 """Algorithm 1: Risk-Based Input Profiling and Sanitization."""
 
+import logging
+import os
 import shlex
-from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
 from .security_patterns import SecurityPatterns
 
+# Manual-review alerts; evaluate.py writes this logger to config.CRITICAL_LOG_PATH
+ALERT_LOGGER = f"{__name__}.alerts"
+
+# Per-process profiler for profile_batch(processes=True)
+_worker_profiler: Optional["RiskProfiler"] = None
+
+def _init_worker():
+    global _worker_profiler
+    _worker_profiler = RiskProfiler()
+
+def _profile_in_worker(command: str) -> Tuple[int, str]:
+    return _worker_profiler.profile_and_sanitize(command)
+
 class RiskProfiler:
     """Implements Layer 1 of the defense architecture."""
 
+    # Quote characters and their PowerShell escapes, substituted in one pass
+    _ESCAPE_TABLE = str.maketrans({'"': '`"', "'": "''"})
+
     def __init__(self):
         self.patterns = SecurityPatterns()
+        self.alert_logger = logging.getLogger(ALERT_LOGGER)
 
     def profile_and_sanitize(self, command: str) -> Tuple[int, str]:
         """
@@ -20,21 +40,26 @@ class RiskProfiler:
         Returns:
             Tuple of (risk_score, sanitized_command).
         """
-        risk = self.patterns.calculate_risk(command)
+        # One scan yields both the score and the matched patterns
+        risk, hits = self.patterns.scan(command)
         sanitized = command
 
         # Apply transformations for high-risk patterns
-        if self.patterns.contains_critical(command):
+        critical = [pat for tier, pat in hits if tier == 'critical']
+        high = [pat for tier, pat in hits if tier == 'high']
+        # Tiers are detected case-insensitively, but only exact-case occurrences
+        # are transformed and alerted on
+        if critical:
             # Critical patterns trigger enhanced sanitization
-            for pat in self.patterns.critical_patterns:
+            for pat in critical:
                 if pat in command:
                     sanitized = self.patterns.apply_parameterized_transformation(sanitized, pat)
                     # Mark for manual review
                     self._log_critical(command)
 
-        elif self.patterns.contains_high(command):
+        elif high:
             # High-risk patterns get transformed
-            for pat in self.patterns.high_patterns:
+            for pat in high:
                 if pat in command:
                     sanitized = self.patterns.apply_parameterized_transformation(sanitized, pat)
 
@@ -43,14 +68,33 @@ class RiskProfiler:
 
         return risk, sanitized
 
+    def profile_batch(self, commands: Iterable[str], workers: Optional[int] = None,
+                      processes: bool = False) -> List[Tuple[int, str]]:
+        """
+        profile_and_sanitize over independent commands, results in input order.
+
+        Threads share this profiler, but CPython's re holds the GIL while
+        matching, so they only scale on free-threaded builds. processes=True
+        runs a ProcessPoolExecutor instead; each worker builds its matchers
+        once and commands are sent in chunks.
+        """
+        commands = list(commands)
+        if not processes:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                return list(ex.map(self.profile_and_sanitize, commands))
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(commands) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+            return list(ex.map(_profile_in_worker, commands, chunksize=chunksize))
+
     def _escape_special_characters(self, cmd: str) -> str:
         """Escape characters that could break out of quotes."""
         # Use shlex.quote for shell safety, but we are in PowerShell context
         # We'll just ensure proper quoting for PowerShell arguments.
         # This is a simplified version.
-        return cmd.replace('"', '`"').replace("'", "''")
+        return cmd.translate(self._ESCAPE_TABLE)
 
     def _log_critical(self, cmd: str):
         """Log a critical pattern for manual review."""
-        # In production, write to a secure log
-        print(f"CRITICAL ALERT: Manual review required for command: {cmd[:100]}")
+        # Goes to the secure log when evaluate.py starts its log listener
+        self.alert_logger.warning("CRITICAL ALERT: Manual review required for command: %s", cmd[:100])
@@ -0,0 +1,150 @@
+"""Persistent PowerShell runspace for line-delimited request/response IPC."""
+
+import base64
+import secrets
+import subprocess
+import threading
+from typing import List, Optional, Sequence
+from . import config
+
+class PwshRunspace:
+    """
+    Long-lived pwsh process running a server loop.
+
+    Each request is sent as one base64-encoded UTF-8 line on stdin; the server
+    script answers with one or more lines terminated by $EndMarker. Engine and
+    module startup are paid once instead of on every call.
+
+    The end marker is random per process and defined as a private variable
+    ahead of the server script, so output from the code being run can neither
+    guess nor read it and cannot end a response early.
+    """
+
+    def __init__(self, server_script: str, pwsh_path: str = "pwsh", timeout: float = 5,
+                 extra_args: Sequence[str] = ()):
+        """
+        Args:
+            server_script: PowerShell loop that reads requests from [Console]::In.
+            pwsh_path: PowerShell executable.
+            timeout: Seconds to wait for a single response before killing pwsh.
+            extra_args: pwsh arguments added after config.PWSH_BASE_ARGS.
+        """
+        self.server_script = server_script
+        self.pwsh_path = pwsh_path
+        self.timeout = timeout
+        self.extra_args = tuple(extra_args)
+        self._proc: Optional[subprocess.Popen] = None
+        self._end_marker = b""
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start pwsh on first use (or after it died)."""
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        self._end_marker = f"<<END-{secrets.token_hex(16)}>>".encode("ascii")
+        script = f"$private:EndMarker = '{self._end_marker.decode()}'\n{self.server_script}"
+        # Binary pipes: responses go straight to the JSON parser without decoding
+        try:
+            self._proc = subprocess.Popen(
+                self._command(script),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL  # never read; a full pipe would stall the server
+            )
+        except OSError as e:
+            raise RuntimeError(f"cannot start pwsh runspace ({self.pwsh_path}): {e}") from e
+
+    def _command(self, script: str) -> List[str]:
+        """argv running script; -EncodedCommand (base64 of UTF-16LE) is immune to argv quoting."""
+        encoded = base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+        return [self.pwsh_path, *config.PWSH_BASE_ARGS, *self.extra_args, "-EncodedCommand", encoded]
+
+    def request(self, payload: str) -> bytes:
+        """
+        Send one request and return the server's raw response (without the end marker).
+
+        Raises:
+            RuntimeError: if pwsh cannot start, exits, or does not answer within
+                the timeout.
+        """
+        line = self._encode(payload)
+        with self._lock:
+            self._ensure_started()
+            proc = self._proc
+            try:
+                proc.stdin.write(line + b"\n")
+                proc.stdin.flush()
+            except OSError as e:
+                raise RuntimeError(f"pwsh runspace pipe failed: {e}") from e
+            return self._read_response(proc)
+
+    def request_many(self, payloads: List[str]) -> List[bytes]:
+        """
+        Send all requests in one pipelined round trip; responses keep input order.
+
+        A writer thread feeds stdin while responses are read back, so large
+        batches cannot deadlock on full pipe buffers.
+        """
+        if not payloads:
+            return []
+        data = b"".join(self._encode(p) + b"\n" for p in payloads)
+        with self._lock:
+            self._ensure_started()
+            proc = self._proc
+            writer = threading.Thread(target=self._write_all, args=(proc, data), daemon=True)
+            writer.start()
+            try:
+                return [self._read_response(proc) for _ in payloads]
+            finally:
+                writer.join()
+
+    @staticmethod
+    def _encode(payload: str) -> bytes:
+        return base64.b64encode(payload.encode("utf-8"))
+
+    @staticmethod
+    def _write_all(proc: subprocess.Popen, data: bytes):
+        try:
+            proc.stdin.write(data)
+            proc.stdin.flush()
+        except OSError:
+            pass  # pwsh died; the reader reports it
+
+    def _read_response(self, proc: subprocess.Popen) -> bytes:
+        # Kill a hung server so the blocking readline below returns EOF
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(self.timeout, kill)
+        watchdog.start()
+        lines: List[bytes] = []
+        try:
+            while True:
+                out = proc.stdout.readline()
+                if not out:
+                    if timed_out.is_set():
+                        raise RuntimeError(f"pwsh runspace did not answer within {self.timeout}s")
+                    raise RuntimeError("pwsh runspace exited unexpectedly")
+                out = out.rstrip(b"\r\n")
+                if out == self._end_marker:
+                    return b"\n".join(lines)
+                lines.append(out)
+        finally:
+            watchdog.cancel()
+
+    def close(self):
+        """Terminate the pwsh process."""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()  # server loop exits on EOF
+            proc.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+
+    def __del__(self):
+        self.close()
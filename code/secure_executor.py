@@ -1,20 +1,91 @@
 """Algorithm 4: Parameterized Secure Execution Wrapper."""
 
+import json
+import os
+import shutil
 import subprocess
 import shlex
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
 import logging
 from . import config
+from .runspace import PwshRunspace
+
+# Server loop: run each command in a fresh runspace of this pwsh process, answer
+# with its exit code and streams. A new runspace per command means functions,
+# aliases, variables and imported modules never carry over, while engine startup
+# is still paid once. *>&1 captures every stream, so nothing the command writes
+# reaches the protocol channel; records are rendered the way pwsh -Command prints
+# them. The process-wide working directory and environment are restored after
+# each command.
+_EXECUTE_SERVER = r"""
+$private:Iss = [System.Management.Automation.Runspaces.InitialSessionState]::CreateDefault()
+$private:BaseDir = [Environment]::CurrentDirectory
+$private:BaseEnv = [Environment]::GetEnvironmentVariables()
+while (($line = [Console]::In.ReadLine()) -ne $null) {
+    $ps = $null
+    try {
+        $cmd = [System.Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($line))
+        $ps = [powershell]::Create($Iss)
+        $null = $ps.AddScript('param($c) & ([scriptblock]::Create($c)) *>&1').AddArgument($cmd)
+        $records = @($ps.Invoke())
+        $errs = @($records | Where-Object { $_ -is [System.Management.Automation.ErrorRecord] }) + @($ps.Streams.Error)
+        $outs = @($records | Where-Object { $_ -isnot [System.Management.Automation.ErrorRecord] } | ForEach-Object {
+            if ($_ -is [System.Management.Automation.WarningRecord]) { "WARNING: $($_.Message)" }
+            elseif ($_ -is [System.Management.Automation.VerboseRecord]) { "VERBOSE: $($_.Message)" }
+            elseif ($_ -is [System.Management.Automation.DebugRecord]) { "DEBUG: $($_.Message)" }
+            elseif ($_ -is [System.Management.Automation.InformationRecord]) { "$($_.MessageData)" }
+            else { $_ }
+        })
+        $exit = $ps.Runspace.SessionStateProxy.GetVariable('LASTEXITCODE')
+        $code = if ($exit) { $exit } elseif ($errs.Count) { 1 } else { 0 }
+        $result = @{ ExitCode = $code; Stdout = ($outs | Out-String); Stderr = (($errs | ForEach-Object { $_.ToString() }) -join "`n") }
+    } catch {
+        # Terminating errors surface as MethodInvocationException from Invoke()
+        $e = $_.Exception
+        if ($e.InnerException) { $e = $e.InnerException }
+        $result = @{ ExitCode = 1; Stdout = ''; Stderr = $e.Message }
+    } finally {
+        if ($ps) {
+            $ps.Runspace.Dispose()
+            $ps.Dispose()
+        }
+        [Environment]::CurrentDirectory = $BaseDir
+        foreach ($name in @([Environment]::GetEnvironmentVariables().Keys)) {
+            if (-not $BaseEnv.Contains($name)) { [Environment]::SetEnvironmentVariable($name, $null) }
+        }
+        foreach ($name in $BaseEnv.Keys) { [Environment]::SetEnvironmentVariable($name, $BaseEnv[$name]) }
+    }
+    [Console]::Out.WriteLine((ConvertTo-Json -InputObject $result -Compress))
+    [Console]::Out.WriteLine($EndMarker)
+    [Console]::Out.Flush()
+}
+"""
+
+# Runs the whole script read from stdin as one scriptblock; plain `-Command -`
+# would execute stdin line by line and break multi-line statements. Exit codes
+# follow -File rather than -Command: `exit N` gives N, a terminating error 1,
+# anything else 0 (-Command would derive it from $? of the last pipeline).
+_STDIN_SCRIPT = (
+    "$sb = [scriptblock]::Create([Console]::In.ReadToEnd()); "
+    "try { & $sb } catch { [Console]::Error.WriteLine($_); exit 1 }; exit 0"
+)
+
+# Resolved once at import; falls back to the bare name so Popen reports a missing pwsh
+_PWSH_PATH = shutil.which(config.POWERSHELL_EXECUTABLE) or config.POWERSHELL_EXECUTABLE
 
 class SecureExecutor:
     """Executes PowerShell commands safely from Python."""
 
     def __init__(self, pwsh_path: str = None, sandbox_dir: Path = None):
-        self.pwsh_path = pwsh_path or config.POWERSHELL_EXECUTABLE
+        self.pwsh_path = pwsh_path or _PWSH_PATH
+        # Kept for callers; scripts go over stdin, so the directory is never created
         self.sandbox_dir = sandbox_dir or config.SANDBOX_DIR
-        self.sandbox_dir.mkdir(parents=True, exist_ok=True)
         self.logger = logging.getLogger(__name__)
+        # Long-lived pwsh for execute(); started on first use
+        self.runspace = PwshRunspace(_EXECUTE_SERVER, self.pwsh_path,
+                                     timeout=config.EXECUTOR_TIMEOUT,
+                                     extra_args=("-ExecutionPolicy", "RemoteSigned"))
 
     def execute(self, cmdlet: str, parameters: Dict[str, Any], context: str = "default") -> Tuple[int, str, str]:
         """
@@ -40,50 +111,66 @@ class SecureExecutor:
 
         # Build the PowerShell command
         ps_cmd = f"{cmdlet} " + " ".join(sanitized_params)
-        # Add security flags
-        full_cmd = [
-            self.pwsh_path,
-            "-NoProfile",
-            "-NonInteractive",
-            "-ExecutionPolicy", "RemoteSigned",
-            "-Command", ps_cmd
-        ]
-
-        self.logger.info(f"Executing: {full_cmd} (context={context})")
+        self.logger.info(f"Executing: {ps_cmd} (context={context})")
 
-        # Run with shell=False to prevent injection
-        proc = subprocess.Popen(
-            full_cmd,
-            shell=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        stdout, stderr = proc.communicate()
-        exit_code = proc.returncode
+        exit_code, stdout, stderr = self._run(ps_cmd)
 
         if exit_code != 0:
             self.logger.warning(f"Execution failed: {stderr}")
 
         return exit_code, stdout, stderr
 
+    def _run(self, ps_cmd: str) -> Tuple[int, str, str]:
+        """
+        Run a command in the persistent runspace.
+
+        A runspace that dies or times out is reported as a failed command and
+        restarted on the next call; the command is not retried, since it may
+        already have had side effects.
+
+        Commands share one pwsh process but each runs in a fresh runspace, so
+        no session state (functions, aliases, variables, modules) carries
+        over; the working directory and environment variables are reset after
+        each command.
+        """
+        try:
+            # The JSON result is always the last line; anything the command wrote
+            # straight to [Console] comes before it
+            result = json.loads(self.runspace.request(ps_cmd).rpartition(b"\n")[2])
+        except (RuntimeError, ValueError) as e:
+            return 1, '', str(e)
+        return int(result.get('ExitCode', 1)), result.get('Stdout') or '', result.get('Stderr') or ''
+
     def execute_script(self, script_content: str, context: str = "sandbox") -> Tuple[int, str, str]:
         """
         Execute an arbitrary PowerShell script (use with caution).
 
         For sandboxed testing only.
         """
-        script_path = self.sandbox_dir / f"temp_{context}.ps1"
-        script_path.write_text(script_content)
-
+        # Script goes over stdin: no file to write, name or unlink
+        self.logger.info(f"Executing script ({len(script_content)} chars, context={context})")
         cmd = [
             self.pwsh_path,
-            "-NoProfile",
-            "-NonInteractive",
+            *config.PWSH_BASE_ARGS,
             "-ExecutionPolicy", "RemoteSigned",
-            "-File", str(script_path)
+            "-Command", _STDIN_SCRIPT
         ]
-        proc = subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = proc.communicate()
-        script_path.unlink(missing_ok=True)
-        return proc.returncode, stdout, stderr
+        proc = subprocess.Popen(cmd, shell=False, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # communicate() feeds stdin and drains both pipes together (selectors on POSIX)
+        try:
+            out, err = proc.communicate(script_content.encode("utf-8"), timeout=config.SCRIPT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # A hung script is reported as a failure instead of blocking the caller
+            proc.kill()
+            try:
+                out, err = proc.communicate(timeout=5)
+            except subprocess.TimeoutExpired:
+                out, err = b'', b''  # a child process of pwsh still holds the pipes
+            err += f"\nScript timed out after {config.SCRIPT_TIMEOUT}s".encode()
+            return 1, out.decode(errors="replace"), err.decode(errors="replace")
+        return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")
+
+    def close(self):
+        """Terminate the persistent runspace."""
+        self.runspace.close()
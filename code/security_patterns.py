@@ -1,9 +1,242 @@
 """Definitions of security patterns and risk scoring (Equation 1)."""
 
 import re
-from typing import List, Tuple, Set
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple, Set
 from . import config
 
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import re2
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+# Characters that give a pattern regex meaning; anything else is a literal
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+# Characters re.IGNORECASE treats as case variants of ASCII letters but that
+# str.lower() does not map to them (dotless/dotted i, long s, Kelvin sign);
+# folded before lowering so obfuscated spellings still match
+_CASE_FOLD = str.maketrans({'\u0131': 'i', '\u0130': 'i', '\u017f': 's', '\u212a': 'k'})
+
+def _is_literal(pattern: str) -> bool:
+    return not _REGEX_METACHARS.intersection(pattern)
+
+def _has_nested_quantifier(pattern: str) -> bool:
+    """
+    Heuristic ReDoS check (safe-regex's star height > 1): an unbounded
+    quantifier (*, +, {n,}) applied to a group that itself contains one,
+    e.g. (a+)+ or (\\w*\\s?)*. Such patterns can backtrack exponentially in re.
+    """
+    def unbounded_at(i: int) -> bool:
+        if i >= len(pattern):
+            return False
+        if pattern[i] in '*+':
+            return True
+        if pattern[i] == '{':
+            end = pattern.find('}', i)
+            return end > 0 and pattern[i + 1:end].endswith(',')
+        return False
+
+    stack = [False]  # per open group: contains an unbounded quantifier
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == '[':
+            # Skip the class; a leading ] (after an optional ^) is literal
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif c == '(':
+            stack.append(False)
+        elif c == ')' and len(stack) > 1:
+            inner = stack.pop()
+            if unbounded_at(i + 1):
+                if inner:
+                    return True
+                stack[-1] = True
+            stack[-1] = stack[-1] or inner
+        elif unbounded_at(i):
+            stack[-1] = True
+        i += 1
+    return False
+
+def _find_quote(text: str, start: int) -> int:
+    """Index of the first ' or " at or after start, or -1."""
+    positions = [i for i in (text.find('"', start), text.find("'", start)) if i >= 0]
+    return min(positions) if positions else -1
+
+def _first_quoted(text: str) -> Optional[str]:
+    """
+    Text between the first pair of quotes on one line (either quote kind closes).
+
+    Same result as re.search(r'["\'](.+?)["\']', text).group(1), without the
+    regex engine: the inner text is non-empty and contains no newline.
+    """
+    start = _find_quote(text, 0)
+    while start >= 0:
+        end = _find_quote(text, start + 2)
+        if end < 0:
+            return None
+        newline = text.find('\n', start + 1, end)
+        if newline < 0:
+            return text[start + 1:end]
+        start = _find_quote(text, newline + 1)
+    return None
+
+class PatternMatcher:
+    """
+    Finds which of many patterns occur in a text.
+
+    Literal patterns are matched together: with pyahocorasick installed in a
+    single pass over the text, otherwise by one combined regex. With
+    regex=True, patterns containing regex syntax are searched individually.
+    """
+
+    def __init__(self, patterns: List[str], ignore_case: bool = True, regex: bool = False):
+        """
+        Args:
+            patterns: Substrings (or regexes, see below); duplicates count as
+                separate entries.
+            ignore_case: Match case-insensitively.
+            regex: Interpret patterns with regex metacharacters as regexes
+                (re.search semantics) instead of literally.
+        """
+        self.patterns = list(patterns)
+        self.ignore_case = ignore_case
+        self._keys = [self._normalize(p) for p in self.patterns]
+        self._automaton = None
+        self._combined = None
+        # (id, compiled, matches normalized text) for patterns with regex syntax
+        self._regexes: List[Tuple[int, "re.Pattern", bool]] = [
+            (i, *self._compile(p)) for i, p in enumerate(self.patterns)
+            if regex and not _is_literal(p)
+        ]
+        regex_ids = {i for i, _, _ in self._regexes}
+        ids_by_key = {}
+        for i, key in enumerate(self._keys):
+            if i not in regex_ids:
+                ids_by_key.setdefault(key, []).append(i)
+        if not ids_by_key:
+            return
+        if AHOCORASICK_AVAILABLE:
+            self._automaton = ahocorasick.Automaton()
+            for key, ids in ids_by_key.items():
+                self._automaton.add_word(key, tuple(ids))
+            self._automaton.make_automaton()
+        else:
+            self._build_combined(ids_by_key)
+
+    def _compile(self, pattern: str) -> Tuple["re.Pattern", bool]:
+        """
+        Compile a regex pattern for iter().
+
+        With google-re2 installed patterns run on its linear-time engine; only
+        those RE2 rejects (backreferences, lookarounds) fall back to re, which
+        refuses patterns with nested unbounded quantifiers (ReDoS).
+
+        Case-insensitive patterns without escapes are lowercased and matched
+        case-sensitively against the already-lowered text, avoiding per-character
+        case folding. Escapes (\\S vs \\s, ...) change meaning when lowered, so
+        those patterns keep re.IGNORECASE and see the original text.
+        """
+        if RE2_AVAILABLE:
+            try:
+                return re2.compile(f"(?i){pattern}" if self.ignore_case else pattern), False
+            except re2.error:
+                pass
+        if _has_nested_quantifier(pattern):
+            raise ValueError(f"pattern {pattern!r} has nested quantifiers (catastrophic backtracking)")
+        if self.ignore_case and '\\' not in pattern:
+            try:
+                return re.compile(self._normalize(pattern)), True
+            except re.error:
+                pass  # e.g. an inline flag that is only valid in upper case
+        return re.compile(pattern, re.IGNORECASE if self.ignore_case else 0), False
+
+    def _build_combined(self, ids_by_key: Dict[str, List[int]]):
+        """
+        Compile all keys into one alternation of named groups inside a lookahead.
+
+        The zero-width lookahead lets finditer() test every start position, so
+        overlapping matches are not consumed. At each position only the first
+        (longest, as keys are sorted longest-first) alternative is reported; any
+        shorter key matching there is a prefix of it, so each group maps to the
+        ids of all keys that are prefixes of its own key.
+        """
+        keys = sorted(ids_by_key, key=len, reverse=True)
+        self._group_ids = {}
+        for j, key in enumerate(keys):
+            self._group_ids[f"g{j}"] = tuple(i for other in keys if key.startswith(other)
+                                             for i in ids_by_key[other])
+        alternatives = "|".join(f"(?P<g{j}>{re.escape(key)})" for j, key in enumerate(keys))
+        self._combined = re.compile(f"(?=(?:{alternatives}))")
+
+    def _normalize(self, text: str) -> str:
+        return text.translate(_CASE_FOLD).lower() if self.ignore_case else text
+
+    def matches(self, text: str) -> Set[int]:
+        """Return the indices (into self.patterns) of patterns found in text."""
+        return set(self.iter(text))
+
+    def any(self, text: str) -> bool:
+        """True if any pattern occurs in text; stops at the first hit."""
+        return next(self.iter(text), None) is not None
+
+    def iter(self, text: str) -> Iterator[int]:
+        """
+        Lazily yield the index of each pattern found in text, once per pattern.
+
+        Literal matches come in text order, then regex matches, so callers
+        can stop scanning early.
+        """
+        normalized = self._normalize(text)
+        if self._automaton is not None:
+            hits = (ids for _, ids in self._automaton.iter(normalized))
+        elif self._combined is not None:
+            hits = (self._group_ids[match.lastgroup] for match in self._combined.finditer(normalized))
+        else:
+            hits = ()
+        seen = set()
+        for ids in hits:
+            for i in ids:
+                if i not in seen:
+                    seen.add(i)
+                    yield i
+        for i, cre, on_normalized in self._regexes:
+            if cre.search(normalized if on_normalized else text):
+                yield i
+
+@lru_cache(maxsize=1)
+def _build_matchers():
+    """
+    Build the matchers for the config patterns once per process.
+
+    Matchers are read-only after construction, so every SecurityPatterns
+    instance (and thread) shares them. Config changes made after the first
+    SecurityPatterns() need _build_matchers.cache_clear().
+    """
+    # One matcher over all tiers scores a command in a single pass (literal
+    # patterns; regex-syntax ones are searched as before); weights by id
+    tiers = [('critical', config.CRITICAL_PATTERNS, config.CRITICAL_WEIGHT),
+             ('high', config.HIGH_RISK_PATTERNS, config.HIGH_WEIGHT),
+             ('medium', config.MEDIUM_RISK_PATTERNS, config.MEDIUM_WEIGHT),
+             ('low', config.LOW_RISK_PATTERNS, config.LOW_WEIGHT)]
+    matcher = PatternMatcher([p for _, patterns, _ in tiers for p in patterns], regex=True)
+    weights = [weight for _, patterns, weight in tiers for _ in patterns]
+    tier_of = [tier for tier, patterns, _ in tiers for _ in patterns]
+    tier_matchers = {tier: PatternMatcher(patterns, regex=True) for tier, patterns, _ in tiers}
+    return matcher, weights, tier_of, tier_matchers
+
 class SecurityPatterns:
     """Encapsulates security pattern definitions and risk scoring."""
 
@@ -12,6 +245,8 @@ class SecurityPatterns:
         self.high_patterns = config.HIGH_RISK_PATTERNS
         self.medium_patterns = config.MEDIUM_RISK_PATTERNS
         self.low_patterns = config.LOW_RISK_PATTERNS
+        (self._matcher, self._weights, self._tier_of,
+         self._tier_matchers) = _build_matchers()
 
     def calculate_risk(self, command: str) -> int:
         """
@@ -24,33 +259,55 @@ class SecurityPatterns:
             Integer risk score (0-10+).
         """
         score = 0
-        for pat in self.critical_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                score += config.CRITICAL_WEIGHT
-        for pat in self.high_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                score += config.HIGH_WEIGHT
-        for pat in self.medium_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                score += config.MEDIUM_WEIGHT
-        for pat in self.low_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                score += config.LOW_WEIGHT
-        return min(score, 10)  # Cap at 10 for normalization
+        for i in self._matcher.iter(command):
+            score += self._weights[i]
+            if score >= 10:
+                return 10  # Cap at 10 for normalization; the rest cannot change it
+        return score
+
+    def scan(self, command: str) -> Tuple[int, List[Tuple[str, str]]]:
+        """
+        Score a command and report what matched, in one pass.
+
+        Returns:
+            (risk score as calculate_risk, [(tier, pattern), ...]) with hits in
+            tier order (critical first) and config order within a tier.
+        """
+        ids = sorted(self._matcher.iter(command))
+        score = sum(self._weights[i] for i in ids)
+        hits = [(self._tier_of[i], self._matcher.patterns[i]) for i in ids]
+        return min(score, 10), hits
+
+    def find_matches(self, command: str, tier: str) -> List[str]:
+        """
+        Patterns of one tier ('critical', 'high', 'medium', 'low') found in command.
+
+        Each pattern is reported once per config entry, in config order.
+        """
+        matcher = self._tier_matchers[tier]
+        return [matcher.patterns[i] for i in sorted(matcher.iter(command))]
+
+    def vulnerability_ids(self, command: str) -> List[int]:
+        """
+        Critical and high patterns found in command, in one pass of the shared matcher.
+
+        Returns:
+            Sorted indices into critical_patterns + high_patterns.
+        """
+        n_vuln = len(self.critical_patterns) + len(self.high_patterns)
+        return sorted(i for i in self._matcher.iter(command) if i < n_vuln)
+
+    def count_vulnerabilities(self, command: str) -> int:
+        """Number of critical and high pattern entries found in command."""
+        return len(self.vulnerability_ids(command))
 
     def contains_critical(self, command: str) -> bool:
         """Check if command contains any critical pattern."""
-        for pat in self.critical_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                return True
-        return False
+        return self._tier_matchers['critical'].any(command)
 
     def contains_high(self, command: str) -> bool:
         """Check if command contains any high-risk pattern."""
-        for pat in self.high_patterns:
-            if re.search(pat, command, re.IGNORECASE):
-                return True
-        return False
+        return self._tier_matchers['high'].any(command)
 
     def get_all_patterns(self) -> List[str]:
         """Return all patterns for matching."""
@@ -66,12 +323,11 @@ class SecurityPatterns:
         # with direct cmdlet invocation.
         if "Invoke-Expression" in pattern or "IEX" in pattern:
             # Extract the inner command if possible (simplistic)
-            match = re.search(r'["\'](.+?)["\']', command)
-            if match:
-                inner = match.group(1)
+            inner = _first_quoted(command)
+            if inner is not None:
                 return f"& {{ {inner} }}"  # Use script block invocation
         # For DownloadString, we might replace with Invoke-RestMethod + hash verification
         if "DownloadString" in pattern:
             # Simplified: replace with Invoke-RestMethod
-            return re.sub(r'DownloadString', 'Invoke-RestMethod', command)
+            return command.replace('DownloadString', 'Invoke-RestMethod')
         return command
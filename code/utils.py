@@ -1,22 +1,141 @@
 """Utility functions."""
 
 import hashlib
+import itertools
 import json
+import logging
+import logging.handlers
+import math
+import queue
+import re
 from pathlib import Path
+from typing import Iterable, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Integer literals orjson would read as floats (it keeps only 64-bit ints)
+_LONG_DIGITS = re.compile(rb'\d{19}')
+
+def _json_loads(data):
+    """
+    Parse JSON from bytes or str, with orjson when installed.
+
+    Anything orjson cannot read exactly (NaN/Infinity, lone surrogate escapes,
+    integers beyond 64 bits) is parsed by json instead.
+    """
+    if orjson is not None:
+        raw = data.encode('utf-8', 'surrogatepass') if isinstance(data, str) else data
+        if not _LONG_DIGITS.search(raw):
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(data)
+
+def _has_non_finite(obj) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(map(_has_non_finite, obj.values()))
+    if isinstance(obj, (list, tuple)):
+        return any(map(_has_non_finite, obj))
+    return False
+
+def _json_dumps(obj) -> bytes:
+    """
+    Compact JSON as bytes, with orjson when installed.
+
+    orjson writes NaN/Infinity as null and rejects lone surrogates and ints
+    beyond 64 bits; such objects are written by json (ASCII-escaped, so
+    surrogates survive) and read back unchanged by _json_loads. Non-ASCII
+    text is raw UTF-8 from orjson and \\u-escaped from json.
+    """
+    if orjson is not None and not _has_non_finite(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode('ascii')
 
 def compute_hash(text: str) -> str:
-    """Compute SHA256 hash of a string."""
-    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    """Compute SHA256 hash of a string (OpenSSL's, SHA-NI accelerated where available)."""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+def compute_hash_batch(texts: Iterable[str]) -> List[str]:
+    """compute_hash for many strings; the constructor lookup is paid once."""
+    sha256 = hashlib.sha256
+    return [sha256(t.encode('utf-8', 'surrogatepass')).hexdigest() for t in texts]
+
+def compute_fingerprint(text: str) -> str:
+    """
+    128-bit BLAKE2b digest of a string, for cache keys and deduplication.
+
+    Faster than SHA256 in software; not meant for integrity checks against an
+    adversary.
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
 
 def load_jsonl(path: Path):
     """Load a JSONL file line by line."""
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         for line in f:
             if line.strip():
-                yield json.loads(line)
+                yield _json_loads(line)
+
+def save_jsonl(data, path: Path, chunk_size: int = 1000):
+    """
+    Save list of dicts as JSONL.
+
+    Lines are joined in chunks of `chunk_size` items and written through a
+    1 MiB buffer, so large datasets take one write call per chunk.
+    """
+    items = iter(data)
+    with open(path, 'wb', buffering=1 << 20) as f:
+        while chunk := list(itertools.islice(items, chunk_size)):
+            f.write(b'\n'.join(map(_json_dumps, chunk)) + b'\n')
+
+class LogListener:
+    """Handle for start_log_listener(); stop() flushes the file and detaches the handler."""
+
+    def __init__(self, logger: logging.Logger, level: int, queue_handler: logging.Handler,
+                 listener: logging.handlers.QueueListener, file_handler: logging.Handler):
+        self.logger = logger
+        self._level = level
+        self._queue_handler = queue_handler
+        self._listener = listener
+        self._file_handler = file_handler
+
+    def stop(self):
+        """Detach from the logger, drain queued records to the file and close it."""
+        self.logger.removeHandler(self._queue_handler)
+        self.logger.setLevel(self._level)
+        self._listener.stop()
+        self._file_handler.close()
+
+def start_log_listener(path: Path, logger_name: str, level: int = logging.WARNING) -> LogListener:
+    """
+    Route records of one logger (and its children) at `level` and above to a
+    file via a background thread.
 
-def save_jsonl(data, path: Path):
-    """Save list of dicts as JSONL."""
-    with open(path, 'w') as f:
-        for item in data:
-            f.write(json.dumps(item) + '\n')
+    The logger only enqueues records (QueueHandler); a QueueListener does the
+    file I/O. Records still propagate to the root logger as before. Call
+    .stop() on the result to flush and detach.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    records = queue.Queue()
+    file_handler = logging.FileHandler(path, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.setLevel(level)
+    logger = logging.getLogger(logger_name)
+    previous_level = logger.level
+    if logger.getEffectiveLevel() > level:
+        logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return LogListener(logger, previous_level, queue_handler, listener, file_handler)
@@ -1,19 +1,50 @@
 """Unit tests for the framework."""
 
+import json
 import pytest
 from pathlib import Path
+import shutil
 import sys
 sys.path.append(str(Path(__file__).parent.parent / "code"))
 
-from security_patterns import SecurityPatterns
+from security_patterns import SecurityPatterns, PatternMatcher, RE2_AVAILABLE
 from risk_profiler import RiskProfiler
 from rag_retriever import RAGRetriever
 from ast_validator import ASTValidator
+from ast_parser import ASTParser, BaseASTParser, TreeSitterParser, TREE_SITTER_AVAILABLE
 from secure_executor import SecureExecutor
+from runspace import PwshRunspace
 from prompt_defense import PromptDefense
 from compliance import ComplianceVerifier
 from metrics import Metrics, CodeBLEU
 from codebleu import CodeBLEUCalculator
+import utils
+from utils import load_jsonl, save_jsonl
+
+class TestJsonl:
+    @pytest.mark.parametrize("use_orjson", [False, True])
+    def test_round_trip(self, tmp_path, monkeypatch, use_orjson):
+        if use_orjson and utils.orjson is None:
+            pytest.skip("orjson not installed")
+        if not use_orjson:
+            monkeypatch.setattr(utils, "orjson", None)
+        items = [{"nan": float("nan"), "inf": [float("inf"), float("-inf")]},
+                 {"surrogate": "\ud800"},
+                 {"big": 2 ** 70, "neg": -2 ** 70},
+                 {1: "int key", "text": "\u00e9\u00fc"}]
+        path = tmp_path / "items.jsonl"
+        save_jsonl(items, path)
+        loaded = list(load_jsonl(path))
+        assert loaded[0]["nan"] != loaded[0]["nan"] and loaded[0]["inf"] == [float("inf"), float("-inf")]
+        assert loaded[1] == {"surrogate": "\ud800"}
+        assert loaded[2] == {"big": 2 ** 70, "neg": -2 ** 70} and type(loaded[2]["big"]) is int
+        assert loaded[3] == {"1": "int key", "text": "\u00e9\u00fc"}
+
+    def test_reads_stdlib_json_lines(self, tmp_path):
+        path = tmp_path / "old.jsonl"
+        path.write_text(json.dumps({"nan": float("nan"), "s": "\ud800", "big": 2 ** 70}) + "\n")
+        [item] = load_jsonl(path)
+        assert item["nan"] != item["nan"] and item["s"] == "\ud800" and item["big"] == 2 ** 70
 
 class TestSecurityPatterns:
     def test_risk_calculation(self):
@@ -28,6 +59,38 @@ class TestSecurityPatterns:
         transformed = sp.apply_parameterized_transformation(cmd, "Invoke-Expression")
         assert "& {" in transformed or transformed != cmd
 
+    def test_scan_and_find_matches(self):
+        sp = SecurityPatterns()
+        cmd = "iex (New-Object Net.WebClient).DownloadString('u')"
+        risk, hits = sp.scan(cmd)
+        assert risk == sp.calculate_risk(cmd)
+        assert ('critical', 'IEX') in hits and ('high', 'DownloadString') in hits
+        assert sp.find_matches(cmd, 'critical') == ['IEX']
+        assert sp.count_vulnerabilities(cmd) == 2
+
+    def test_unicode_case_variants(self):
+        # Spellings re.IGNORECASE treats as case variants (dotless/dotted i, long s)
+        sp = SecurityPatterns()
+        for cmd in ["\u0131ex 'x'", "\u0130EX x", "Invoke-Expre\u017f\u017fion x"]:
+            assert sp.calculate_risk(cmd) == 3
+            assert sp.contains_critical(cmd) is True
+        assert sp.calculate_risk("ByPa\u017f\u017f") == 2
+
+class TestPatternMatcher:
+    def test_matches(self):
+        pm = PatternMatcher(["IEX", "Bypass", "ExecutionPolicy Bypass", "Bypass"])
+        assert pm.matches("iex -executionpolicy bypass") == {0, 1, 2, 3}
+        assert pm.matches("Get-Process") == set()
+        strict = PatternMatcher(["IEX"], ignore_case=False)
+        assert strict.matches("iex") == set()
+        assert pm.any("x; IEX y") and not pm.any("Get-Process")
+
+    @pytest.mark.skipif(RE2_AVAILABLE, reason="RE2 runs nested quantifiers in linear time")
+    def test_rejects_nested_quantifiers(self):
+        with pytest.raises(ValueError):
+            PatternMatcher([r"(\w+\s?)+$"], regex=True)
+        assert PatternMatcher([r"Invoke-\w+"], regex=True).matches("invoke-webrequest") == {0}
+
 class TestRiskProfiler:
     def test_profile_and_sanitize(self):
         rp = RiskProfiler()
@@ -36,6 +99,18 @@ class TestRiskProfiler:
         assert risk >= 3
         assert sanitized != cmd
 
+    def test_transforms_exact_case_only(self):
+        rp = RiskProfiler()
+        cmd = 'iex (New-Object Net.WebClient).DownloadString("u")'
+        risk, sanitized = rp.profile_and_sanitize(cmd)
+        assert risk >= 3  # detected case-insensitively
+        assert sanitized == rp._escape_special_characters(cmd)  # lowercase iex left as is
+
+    def test_profile_batch(self):
+        rp = RiskProfiler()
+        cmds = ["Invoke-Expression 'calc.exe'", "Get-Process", "x.DownloadString('u')"]
+        assert rp.profile_batch(cmds, workers=2) == [rp.profile_and_sanitize(c) for c in cmds]
+
 class TestRAGRetriever:
     def test_retrieve(self, tmp_path):
         kb = tmp_path / "kb.json"
@@ -53,12 +128,124 @@ class TestASTValidator:
         # May fail if pwsh not available, so we skip or mock
         assert 'pass' in result
 
+class TestASTParser:
+    @pytest.mark.skipif(shutil.which("pwsh") is None, reason="pwsh not installed")
+    def test_shared_runspace(self):
+        parser = ASTParser(pwsh_path="pwsh")  # Assumes pwsh in PATH
+        validator = ASTValidator(parser=parser)
+        cb = CodeBLEUCalculator(parser=parser)
+        assert 'CommandAst' in parser.parse("Get-Process")
+        assert 'pass' in validator.validate("Get-Process")
+        assert cb._get_ast_node_types("Get-Process") == parser.parse("Get-Process")
+        parser.close()
+
+    @pytest.mark.skipif(not TREE_SITTER_AVAILABLE, reason="tree-sitter-powershell not installed")
+    def test_tree_sitter_backend(self):
+        parser = TreeSitterParser()
+        validator = ASTValidator(parser=parser)
+        assert 'command' in parser.parse("Get-Process")
+        result = validator.validate('(New-Object Net.WebClient).DownloadString("http://x")')
+        assert result['pass'] is False
+
+    def test_disk_cache(self, tmp_path):
+        class CountingParser(BaseASTParser):
+            version = "v1"
+            calls = 0
+
+            def _parse_uncached(self, code):
+                CountingParser.calls += 1
+                return (self.version, code)
+
+            def _cache_version(self):
+                return self.version
+
+        first, second = CountingParser(cache_dir=tmp_path), CountingParser(cache_dir=tmp_path)
+        assert first.parse("Get-Process") == ["v1", "Get-Process"]
+        assert second.parse("Get-Process") == ["v1", "Get-Process"]  # shared cache file
+        assert CountingParser.calls == 1
+        CountingParser.version = "v2"
+        third = CountingParser(cache_dir=tmp_path)
+        assert third.parse("Get-Process") == ["v2", "Get-Process"]  # new version, new file
+        for parser in (first, second, third):
+            parser.close()
+
 class TestSecureExecutor:
     def test_execute(self):
         executor = SecureExecutor()
         exit_code, stdout, stderr = executor.execute("Get-Process", {"Name": "pwsh"})
         assert exit_code == 0 or exit_code is not None  # actual depends on system
 
+    @pytest.mark.skipif(shutil.which("pwsh") is None, reason="pwsh not installed")
+    def test_execute_isolates_session_state(self):
+        executor = SecureExecutor()
+        try:
+            executor.execute("Set-Alias", {"Name": "leaked", "Value": "Get-Date", "Scope": "Global"})
+            exit_code, _, stderr = executor.execute("leaked", {})
+            assert exit_code != 0 and stderr
+        finally:
+            executor.close()
+
+    @pytest.mark.skipif(shutil.which("pwsh") is None, reason="pwsh not installed")
+    def test_execute_script_exit_codes(self):
+        executor = SecureExecutor()
+        exit_code, stdout, _ = executor.execute_script("Write-Output ok")
+        assert exit_code == 0 and stdout.strip() == "ok"
+        assert executor.execute_script("Write-Error 'soft'")[0] == 0  # as with -File
+        assert executor.execute_script("if ($true) {\n    exit 3\n}")[0] == 3
+        assert executor.execute_script("throw 'boom'")[0] == 1
+
+    def test_execute_script_stub(self, tmp_path, monkeypatch):
+        # Stand-in for pwsh: echoes the script from stdin, or hangs on "hang"
+        stub = tmp_path / "pwsh"
+        stub.write_text(f"#!{sys.executable}\n"
+                        "import sys, time\n"
+                        "script = sys.stdin.read()\n"
+                        "if script == 'hang':\n"
+                        "    time.sleep(60)\n"
+                        "sys.stdout.write(script)\n"
+                        "sys.exit(3)\n")
+        stub.chmod(0o755)
+        monkeypatch.setattr(sys.modules[SecureExecutor.__module__].config, "SCRIPT_TIMEOUT", 1)
+        executor = SecureExecutor(pwsh_path=str(stub))
+        assert executor.execute_script("Write-Output ok") == (3, "Write-Output ok", "")
+        exit_code, _, stderr = executor.execute_script("hang")
+        assert exit_code == 1 and "timed out" in stderr
+
+    def test_runspace_errors(self):
+        with pytest.raises(RuntimeError, match="cannot start"):
+            PwshRunspace("", pwsh_path="/nonexistent/pwsh").request("x")
+
+        class HungRunspace(PwshRunspace):
+            def _command(self, script):
+                return [sys.executable, "-c", "import time; time.sleep(60)"]
+
+        with pytest.raises(RuntimeError, match="did not answer"):
+            HungRunspace("", timeout=0.5).request("x")
+
+    def test_runspace_framing(self):
+        # Stub server: stray output (including the old fixed marker) precedes each result
+        stub = (
+            "import base64, json, re, sys\n"
+            "marker = re.search(r'<<END-[0-9a-f]+>>', sys.argv[1]).group(0)\n"
+            "for line in sys.stdin:\n"
+            "    cmd = base64.b64decode(line).decode()\n"
+            "    print('WARNING: noise'); print('<<END>>')\n"
+            "    print(json.dumps({'ExitCode': 0, 'Stdout': cmd, 'Stderr': ''}))\n"
+            "    print(marker, flush=True)\n"
+        )
+
+        class StubRunspace(PwshRunspace):
+            def _command(self, script):
+                return [sys.executable, "-c", stub, script]
+
+        executor = SecureExecutor()
+        executor.runspace = StubRunspace("", timeout=10)
+        try:
+            assert executor.execute("Get-Process", {"Id": 1}) == (0, "Get-Process -Id 1", "")
+            assert executor.execute("Get-Service", {"Name": "x"}) == (0, "Get-Service -Name x", "")
+        finally:
+            executor.close()
+
 class TestPromptDefense:
     def test_protect_prompt(self):
         pd = PromptDefense("System instruction")
@@ -115,3 +302,27 @@ def test_codebleu():
     cand2 = "Get-Service -Name notepad"
     score = cb.compute(ref, cand2)
     assert 0.0 < score < 1.0
+
+# nltk sentence_bleu(SmoothingFunction().method1) on the same tokens
+BLEU_REFERENCE_VALUES = [
+    ("Get-Process -Name pwsh", "Get-Process -Name pwsh", 1.0),
+    ("Get-Process -Name pwsh | Stop-Process", "Get-Process", 0.0011981952414407235),  # short candidate
+    ("a b c d e", "a b", 0.07055995207471726),  # short candidate, no 3/4-grams
+    ("Get-Service", "Remove-Item x", 0.0),  # zero unigram overlap
+    ("Get-ChildItem -Path C:\\ -Recurse -Filter *.log",
+     "Get-ChildItem -Path D:\\ -Filter *.txt -Recurse", 0.3784481137591871),
+    ("Get-Content a.txt", "Get-Content a.txt | Select-Object -First 5", 0.2984745896009823),  # longer candidate
+]
+
+@pytest.mark.parametrize("reference, candidate, expected", BLEU_REFERENCE_VALUES)
+def test_bleu_pinned_values(reference, candidate, expected):
+    cb = CodeBLEUCalculator(parser=ASTParser())  # pwsh is never started for BLEU
+    score = cb._bleu(cb._tokenize(reference), cb._tokenize(candidate))
+    assert score == pytest.approx(expected, rel=1e-12, abs=1e-15)
+
+def test_codebleu_identical_tokens():
+    cb = CodeBLEUCalculator(parser=ASTParser())  # identical snippets never reach the parser
+    short = cb.compute("Get-Process", "Get-Process")
+    assert short == cb.compute("Get-Process", "Get-Process ")  # surrounding whitespace does not matter
+    assert short == pytest.approx(0.5 * cb._bleu(("Get-Process",), ("Get-Process",)) + 0.5)
+    assert short < 1.0  # fewer tokens than ngram_order